@@ -1,17 +1,45 @@
 from dotenv import load_dotenv
-import csv, requests, sqlite3, os
+import csv, json, requests_cache, sqlite3, os, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
+from top5_analysis import ensure_indexes, slugify
+
 def get_tmdb_credentials():
-    load_dotenv("Credentials/TMDB_key_credentials.env")
+    # Already exported (or loaded by another module) -> skip re-reading the .env
+    if "TMDB_API_KEY" not in os.environ:
+        load_dotenv("Credentials/TMDB_key_credentials.env")
     return os.getenv("TMDB_ACCESS_TOKEN"), os.getenv("TMDB_API_KEY")
 
 TMDB_ACCESS_TOKEN, TMDB_API_KEY = get_tmdb_credentials()
 
 CSV_PATH = Path("data/letterboxd/ratings.csv")
+DIARY_CSV_PATH = Path("data/letterboxd/diary.csv")
 DB_PATH = Path("data/movies.db")
 
+# TMDB allows roughly 40 requests per 10 seconds; each movie costs two calls,
+# so keep the number of movies fetched in parallel well below that.
+TMDB_MAX_WORKERS = 8
+TMDB_MAX_RETRIES = 5
+
+# On-disk cache of TMDB responses. Lives outside movies.db so rebuilding
+# the database doesn't have to fetch everything from TMDB again.
+TMDB_CACHE_PATH = Path("data/tmdb_cache.sqlite")
+SESSION = requests_cache.CachedSession(
+    str(TMDB_CACHE_PATH),
+    backend="sqlite",
+    expire_after=timedelta(days=30),
+)
+
+# Keep-alive: one pooled connection per worker thread, so the TLS handshake
+# is paid once per connection, not once per request. All calls go to the
+# same host, so a single host pool is enough.
+SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=TMDB_MAX_WORKERS))
+
 # ====== DB SETUP ======
 def create_tables(conn):
     cur = conn.cursor()
@@ -24,7 +52,8 @@ def create_tables(conn):
             director    TEXT,
             year        INTEGER,
             length_min  INTEGER,
-            rating      REAL
+            rating      REAL,
+            slug        TEXT    -- image folder name, see slugify()
         );
     """)
 
@@ -58,8 +87,50 @@ def create_tables(conn):
 
     conn.commit()
 
+    # Indexes for the diary/movie joins in the analysis scripts
+    ensure_indexes(conn)
+
 
 # ====== TMDB HELPERS ======
+def retry_after_seconds(retry_after, default):
+    """
+    Seconds to wait according to a Retry-After header, which is either a
+    number of seconds or an HTTP date. Falls back to default if missing/invalid.
+    """
+    if not retry_after:
+        return default
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return default
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def tmdb_get(url, params):
+    """
+    GET a TMDB endpoint (through the on-disk cache) and return the JSON body.
+    Retries with exponential backoff when TMDB answers 429 (rate limited).
+    """
+    delay = 1.0
+    for attempt in range(TMDB_MAX_RETRIES):
+        resp = SESSION.get(url, params=params, timeout=30)
+        if resp.status_code != 429 or attempt == TMDB_MAX_RETRIES - 1:
+            break
+
+        # Respect Retry-After if TMDB sends it, otherwise back off
+        time.sleep(retry_after_seconds(resp.headers.get("Retry-After"), delay))
+        delay *= 2
+
+    resp.raise_for_status()
+    return resp.json()
+
+
 def tmdb_search_movie(title):
     """
     Search TMDB by title and return the best match (or None).
@@ -70,9 +141,7 @@ def tmdb_search_movie(title):
         "query": title,
         "include_adult": "false",
     }
-    resp = requests.get(url, params=params)
-    resp.raise_for_status()
-    data = resp.json()
+    data = tmdb_get(url, params)
 
     results = data.get("results", [])
     if not results:
@@ -92,179 +161,306 @@ def tmdb_get_movie_details_and_credits(tmdb_id):
         "api_key": TMDB_API_KEY,
         "append_to_response": "credits",
     }
-    resp = requests.get(url, params=params)
-    resp.raise_for_status()
-    return resp.json()
+    return tmdb_get(url, params)
+
+
+def fetch_movie(title):
+    """
+    Search TMDB for a title and fetch its details + credits.
+    Returns (tmdb_id, details) or None if the movie could not be fetched.
+    """
+    try:
+        search_result = tmdb_search_movie(title)
+    except Exception:
+        # If TMDB search fails, skip this row
+        return None
+
+    if not search_result:
+        # No result found
+        return None
+
+    tmdb_id = search_result["id"]
+
+    # --- TMDB: details + credits in one call ---
+    try:
+        details = tmdb_get_movie_details_and_credits(tmdb_id)
+    except Exception:
+        return None
+
+    return tmdb_id, details
 
 
 # ====== DB INSERT HELPERS ======
-def get_or_create_person(conn, name):
+# Static SQL, so sqlite3 compiles each statement once and reuses it for
+# every row passed to executemany.
+UPSERT_MOVIE_SQL = """
+    INSERT INTO movie (tmdb_id, title, director, year, length_min, rating, slug)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(tmdb_id) DO UPDATE SET
+        title      = excluded.title,
+        director   = excluded.director,
+        year       = excluded.year,
+        length_min = excluded.length_min,
+        rating     = excluded.rating,
+        slug       = excluded.slug;
+"""
+
+UPDATE_MOVIE_RATING_SQL = "UPDATE movie SET rating = ? WHERE title = ?;"
+
+INSERT_PERSON_SQL = "INSERT OR IGNORE INTO person (name) VALUES (?);"
+
+DELETE_MOVIE_CAST_SQL = """
+    DELETE FROM movie_cast
+    WHERE movie_id IN (SELECT value FROM json_each(?));
+"""
+
+INSERT_MOVIE_CAST_SQL = """
+    INSERT INTO movie_cast (movie_id, person_id, billing_order)
+    VALUES (?, ?, ?);
+"""
+
+INSERT_DIARY_SQL = """
+    INSERT INTO diary (movie_id, watched_date, rewatch)
+    VALUES (?, ?, ?);
+"""
+
+# Room for the schema, import and lookup statements of a build
+CACHED_STATEMENTS = 256
+
+
+def load_person_cache(conn):
+    """
+    Return a dict mapping person name -> person id for everyone in the DB.
+    """
     cur = conn.cursor()
+    cur.execute("SELECT name, id FROM person")
+    return dict(cur.fetchall())
 
-    # Try to find existing person
-    cur.execute("SELECT id FROM person WHERE name = ?", (name,))
-    row = cur.fetchone()
-    if row:
-        return row[0]
 
-    # Insert new person
-    cur.execute("INSERT INTO person (name) VALUES (?)", (name,))
-    return cur.lastrowid
+def create_missing_people(conn, person_cache, names):
+    """
+    Insert every name not yet in person_cache and add the new ids to it.
+    """
+    # dict.fromkeys keeps first-seen order, so ids follow billing order
+    new_names = list(dict.fromkeys(name for name in names if name not in person_cache))
+    if not new_names:
+        return
+
+    cur = conn.cursor()
 
+    # Remember where the new ids start so only those are read back
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM person")
+    (max_id,) = cur.fetchone()
 
-def insert_or_update_movie(conn, tmdb_id, title, director, year, length_min, rating):
+    cur.executemany(INSERT_PERSON_SQL, [(name,) for name in new_names])
+
+    cur.execute("SELECT name, id FROM person WHERE id > ?", (max_id,))
+    person_cache.update(cur.fetchall())
+
+
+def insert_or_update_movies(conn, movie_rows):
+    """
+    Upsert all movies in one executemany.
+    movie_rows: list of (tmdb_id, title, director, year, length_min, rating, slug).
+    Returns a dict mapping tmdb_id -> internal movie id.
+    """
     cur = conn.cursor()
 
     # UPSERT based on tmdb_id
-    cur.execute("""
-        INSERT INTO movie (tmdb_id, title, director, year, length_min, rating)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ON CONFLICT(tmdb_id) DO UPDATE SET
-            title      = excluded.title,
-            director   = excluded.director,
-            year       = excluded.year,
-            length_min = excluded.length_min,
-            rating     = excluded.rating;
-    """, (tmdb_id, title, director, year, length_min, rating))
-
-    # Get internal movie id
-    cur.execute("SELECT id FROM movie WHERE tmdb_id = ?", (tmdb_id,))
-    row = cur.fetchone()
-    return row[0]
-
-
-def replace_movie_cast(conn, movie_id, cast_names_in_order):
+    cur.executemany(UPSERT_MOVIE_SQL, movie_rows)
+
+    # Get internal movie ids with one query instead of one per movie
+    # (executemany can't return rows, so RETURNING id is no help here)
+    cur.execute("SELECT tmdb_id, id FROM movie")
+    return dict(cur.fetchall())
+
+
+def replace_movie_cast(conn, cast_by_movie, person_cache, fresh_build=False):
     """
-    Replace the cast for this movie with the given top N names.
+    Replace the cast for each movie with the given top N names.
+    cast_by_movie: dict mapping movie_id -> list of names in billing order.
+    person_cache: dict mapping name -> person id, see load_person_cache().
+    fresh_build: the tables were just created, so there is no old cast to delete.
     """
     cur = conn.cursor()
 
-    # Delete previous cast entries for this movie (if any)
-    cur.execute("DELETE FROM movie_cast WHERE movie_id = ?", (movie_id,))
+    # Delete previous cast entries for these movies (if any), in one statement
+    if not fresh_build and cast_by_movie:
+        cur.execute(DELETE_MOVIE_CAST_SQL, (json.dumps(list(cast_by_movie)),))
+
+    # Only the top 10 actors are stored
+    top_casts = {
+        movie_id: names[:10] for movie_id, names in cast_by_movie.items()
+    }
+    create_missing_people(
+        conn,
+        person_cache,
+        (name for names in top_casts.values() for name in names),
+    )
+
+    # Insert actors in order
+    cast_rows = []
+    for movie_id, cast_names_in_order in top_casts.items():
+        for order, name in enumerate(cast_names_in_order, start=1):
+            cast_rows.append((movie_id, person_cache[name], order))
 
-    # Insert up to 10 actors in order
-    for order, name in enumerate(cast_names_in_order[:10], start=1):
-        person_id = get_or_create_person(conn, name)
-        cur.execute("""
-            INSERT INTO movie_cast (movie_id, person_id, billing_order)
-            VALUES (?, ?, ?);
-        """, (movie_id, person_id, order))
+    cur.executemany(INSERT_MOVIE_CAST_SQL, cast_rows)
 
 
 # ====== MAIN IMPORT LOGIC ======
-def process_csv(conn):
+def read_csv_columns(path, columns):
     """
-    Read ratings.csv and import all movies into the database.
-    - 2nd column = movie title (index 1)
-    - 5th column = rating (index 4)
-    - First row is header
+    Yield the given columns of a Letterboxd export as tuples of stripped strings.
+    The header is checked once up front, so a renamed or missing column fails
+    loudly instead of silently skipping every row.
     """
+    with path.open(newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+
+        missing = [c for c in columns if c not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"{path} is missing column(s): {', '.join(missing)}")
+
+        for row in reader:
+            # Short rows give None for the missing fields
+            yield tuple((row[c] or "").strip() for c in columns)
 
-    with CSV_PATH.open(newline="", encoding="utf-8") as f:
-        reader = csv.reader(f)
 
-        # Skip header row
-        header = next(reader, None)
+def process_csv(conn, fresh_build=False):
+    """
+    Read ratings.csv and import all movies into the database.
+    - "Name" column = movie title
+    - "Rating" column = rating
 
-        rows = list(reader)       # so we know total length exactly
-        for row_index, row in enumerate(tqdm(rows, desc="Importing movies"), start=2):
+    TMDB lookups run in parallel first; the database is only written to
+    afterwards, from the calling thread. Each title is looked up at most
+    once, and titles already in the movie table only get their rating updated.
+    fresh_build: the tables are new and empty (see build()).
+    """
 
-            # Basic sanity check
-            if len(row) < 5:
-                # Skip rows that don't have enough columns
-                continue
+    # --- Parse CSV into title -> rating ---
+    # Rows are streamed; only the two fields we need are kept.
+    # A title listed twice keeps its last rating, like the upsert did.
+    ratings_by_title = {}
+    for title, rating_str in read_csv_columns(CSV_PATH, ("Name", "Rating")):
+        if not title:
+            continue
 
-            title = row[1].strip()       # 2nd column
-            rating_str = row[4].strip()  # 5th column
+        try:
+            rating = float(rating_str)
+        except ValueError:
+            # If rating can't be parsed, skip
+            continue
 
-            if not title:
-                continue
+        ratings_by_title[title] = rating
 
+    # --- Movies already in the DB need no TMDB calls ---
+    cur = conn.cursor()
+    cur.execute("SELECT title FROM movie")
+    existing_titles = {title for (title,) in cur.fetchall()}
+
+    cur.executemany(UPDATE_MOVIE_RATING_SQL, [
+        (rating, title)
+        for title, rating in ratings_by_title.items()
+        if title in existing_titles
+    ])
+
+    movies_to_fetch = [
+        (title, rating)
+        for title, rating in ratings_by_title.items()
+        if title not in existing_titles
+    ]
+
+    # --- TMDB: fetch all movies concurrently ---
+    fetched = {}
+    with ThreadPoolExecutor(max_workers=TMDB_MAX_WORKERS) as pool:
+        futures = {
+            pool.submit(fetch_movie, title): index
+            for index, (title, _) in enumerate(movies_to_fetch)
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Importing movies"):
+            fetched[futures[future]] = future.result()
+
+    # --- Collect DB rows, in CSV order ---
+    # Keyed by tmdb_id so a movie that appears twice is only written once
+    # (last row wins, same as the old per-row upsert).
+    movie_rows = {}
+    cast_by_tmdb_id = {}
+    for index, (title, rating) in enumerate(movies_to_fetch):
+        result = fetched[index]
+        if result is None:
+            continue
+
+        tmdb_id, details = result
+
+        # Title (prefer TMDB title)
+        tmdb_title = title  # always use CSV title
+
+        # Year from release_date
+        release_date = details.get("release_date") or ""
+        year = None
+        if len(release_date) >= 4:
             try:
-                rating = float(rating_str)
+                year = int(release_date[:4])
             except ValueError:
-                # If rating can't be parsed, skip
-                continue
+                year = None
 
-            # --- TMDB: search movie ---
-            try:
-                search_result = tmdb_search_movie(title)
-            except Exception:
-                # If TMDB search fails, skip this row
-                continue
+        # Runtime
+        length_min = details.get("runtime")
 
-            if not search_result:
-                # No result found
-                continue
+        # Credits: director and top cast
+        credits = details.get("credits", {}) or {}
 
-            tmdb_id = search_result["id"]
+        director_name = None
+        for crew_member in credits.get("crew", []):
+            if crew_member.get("job") == "Director":
+                director_name = crew_member.get("name")
+                break
 
-            # --- TMDB: details + credits in one call ---
-            try:
-                details = tmdb_get_movie_details_and_credits(tmdb_id)
-            except Exception:
-                continue
-
-            # Title (prefer TMDB title)
-            tmdb_title = title  # always use CSV title
-
-            # Year from release_date
-            release_date = details.get("release_date") or ""
-            year = None
-            if len(release_date) >= 4:
-                try:
-                    year = int(release_date[:4])
-                except ValueError:
-                    year = None
-
-            # Runtime
-            length_min = details.get("runtime")
-
-            # Credits: director and top cast
-            credits = details.get("credits", {}) or {}
-
-            director_name = None
-            for crew_member in credits.get("crew", []):
-                if crew_member.get("job") == "Director":
-                    director_name = crew_member.get("name")
-                    break
-
-            cast_list = credits.get("cast", []) or []
-            top_cast_names = [c.get("name") for c in cast_list if c.get("name")]
-
-            # --- Insert into DB (movie + cast) ---
-            movie_id = insert_or_update_movie(
-                conn,
-                tmdb_id=tmdb_id,
-                title=tmdb_title,
-                director=director_name,
-                year=year,
-                length_min=length_min,
-                rating=rating,
-            )
-
-            replace_movie_cast(conn, movie_id, top_cast_names)
+        cast_list = credits.get("cast", []) or []
+        # dict.fromkeys drops actors credited for more than one role
+        top_cast_names = list(dict.fromkeys(c.get("name") for c in cast_list if c.get("name")))
+
+        movie_rows[tmdb_id] = (
+            tmdb_id, tmdb_title, director_name, year, length_min, rating, slugify(tmdb_title),
+        )
+        cast_by_tmdb_id[tmdb_id] = top_cast_names
+
+    # --- Insert into DB (movie + cast) ---
+    movie_ids = insert_or_update_movies(conn, list(movie_rows.values()))
+
+    person_cache = load_person_cache(conn)
+    replace_movie_cast(conn, {
+        movie_ids[tmdb_id]: names for tmdb_id, names in cast_by_tmdb_id.items()
+    }, person_cache, fresh_build=fresh_build)
 
 
 def build():
     # Remove old database files if they exist
     for ext in ("", "-wal", "-shm"):
-        path = f"movies.db{ext}"
+        path = f"{DB_PATH}{ext}"
         if os.path.exists(path):
             os.remove(path)
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, cached_statements=CACHED_STATEMENTS)
 
-    # Better performance: turn on WAL journal mode (optional but nice)
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA synchronous=NORMAL;")
+    # Bulk-build settings. No crash safety needed here: build() always
+    # starts from an empty database and can simply be re-run from the CSV.
+    conn.execute("PRAGMA synchronous=OFF;")
+    conn.execute("PRAGMA journal_mode=MEMORY;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute("PRAGMA cache_size=-262144;")    # 256 MiB page cache
+    conn.execute("PRAGMA mmap_size=268435456;")   # 256 MiB memory map
 
     create_tables(conn)
 
     # HUGE speedup: one big transaction
     try:
         conn.execute("BEGIN")
-        process_csv(conn)
+        process_csv(conn, fresh_build=True)
+
+        # Fresh statistics for the query planner
+        conn.execute("ANALYZE;")
         conn.commit()
     except Exception:
         conn.rollback()
@@ -272,54 +468,60 @@ def build():
     finally:
         conn.close()
 
-def diary():
-    conn = sqlite3.connect(DB_PATH)
+def process_diary_csv(conn):
+    """
+    Read diary.csv and store every entry whose movie is in the database.
+    - "Name" column = movie title
+    - "Rewatch" column = rewatch
+    - "Watched Date" column = watched date
+    """
     cur = conn.cursor()
 
-    diary_csv_path = Path("data/letterboxd/diary.csv")
-
-    with diary_csv_path.open(newline="", encoding="utf-8") as f:
-        reader = csv.reader(f)
-
-        # Skip header
-        header = next(reader, None)
+    # Map title -> movie id once instead of querying per diary row.
+    # If two movies share a title, the first one imported wins.
+    title_to_id = {}
+    for movie_id, title in cur.execute("SELECT id, title FROM movie ORDER BY id"):
+        title_to_id.setdefault(title, movie_id)
 
-        for row_index, row in enumerate(reader, start=2):
-            if len(row) < 8:
-                # not enough columns, skip
-                continue
+    diary_rows = []
+    columns = ("Name", "Rewatch", "Watched Date")
+    for title, rewatch_str, watched_date in read_csv_columns(DIARY_CSV_PATH, columns):
+        if not title or not watched_date:
+            continue
 
-            title = row[1].strip()       # 2nd column: movie title
-            rewatch_str = row[5].strip() # 6th column: rewatch
-            watched_date = row[7].strip()# 8th column: watched date
+        # Convert rewatch to 0/1
+        # Letterboxd usually uses "Yes"/"" but we handle common variants.
+        r = rewatch_str.lower()
+        rewatch = 1 if r in ("yes", "true", "1", "y") else 0
 
-            if not title or not watched_date:
-                continue
+        # Find movie id by title
+        movie_id = title_to_id.get(title)
 
-            # Convert rewatch to 0/1
-            # Letterboxd usually uses "Yes"/"" but we handle common variants.
-            r = rewatch_str.lower()
-            rewatch = 1 if r in ("yes", "true", "1", "y") else 0
+        if movie_id is None:
+            # Movie not found in movie table -> skip this diary entry
+            # (You could also log these if you want)
+            continue
 
-            # Find movie id by title
-            cur.execute("SELECT id FROM movie WHERE title = ?", (title,))
-            row_movie = cur.fetchone()
+        diary_rows.append((movie_id, watched_date, rewatch))
 
-            if not row_movie:
-                # Movie not found in movie table -> skip this diary entry
-                # (You could also log these if you want)
-                continue
+    # Insert all diary rows at once
+    cur.executemany(INSERT_DIARY_SQL, diary_rows)
 
-            movie_id = row_movie[0]
 
-            # Insert diary row
-            cur.execute("""
-                INSERT INTO diary (movie_id, watched_date, rewatch)
-                VALUES (?, ?, ?);
-            """, (movie_id, watched_date, rewatch))
+def diary():
+    conn = sqlite3.connect(DB_PATH, cached_statements=CACHED_STATEMENTS)
 
-    conn.commit()
-    conn.close()
+    # Explicit transaction, same as build(): all diary rows or none
+    try:
+        conn.execute("BEGIN")
+        process_diary_csv(conn)
+        conn.execute("ANALYZE;")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
     input = int(input("Select an option:\n1. Build database from ratings.csv\n2. Store diary from diary.csv (only if movie.db exist)\n"))
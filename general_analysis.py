@@ -29,27 +29,25 @@ def get_total_durations(conn):
     """
     cur = conn.cursor()
 
-    # ---- total time actually watched (from diary) ----
+    # ---- watched: one row per diary entry (incl. rewatches) ----
+    # ---- library: all movies in the library (each once) ----
     cur.execute("""
         SELECT
-            SUM(m.length_min * d.watch_count) AS total_minutes
-        FROM movie m
-        JOIN (
-            SELECT movie_id, COUNT(*) AS watch_count
-            FROM diary
-            GROUP BY movie_id
-        ) d ON m.id = d.movie_id;
+            (SELECT SUM(m.length_min)
+             FROM diary d
+             JOIN movie m ON m.id = d.movie_id) AS watched_minutes,
+            (SELECT SUM(length_min)
+             FROM movie) AS library_minutes;
     """)
-    (watched_minutes,) = cur.fetchone()
+    watched_minutes, library_minutes = cur.fetchone()
+    return build_durations(watched_minutes, library_minutes)
+
+def build_durations(watched_minutes, library_minutes):
+    """
+    Shape raw minute totals (None if there are no rows) like get_total_durations().
+    """
     if watched_minutes is None:
         watched_minutes = 0
-
-    # ---- total time of all movies in the library (each once) ----
-    cur.execute("""
-        SELECT SUM(length_min) AS total_minutes
-        FROM movie;
-    """)
-    (library_minutes,) = cur.fetchone()
     if library_minutes is None:
         library_minutes = 0
 
@@ -64,6 +62,46 @@ def get_total_durations(conn):
         },
     }
 
+def get_all_stats(conn):
+    """
+    Movie count, director count and durations in ONE query,
+    scanning the movie table once instead of three times.
+    Returns:
+      {
+        "movie_count": ...,
+        "director_count": ...,
+        "durations": { ... },  # same as get_total_durations()
+      }
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        WITH library AS (
+            SELECT
+                COUNT(*) AS movie_count,
+                COUNT(DISTINCT director) AS director_count,  -- skips NULLs
+                SUM(length_min) AS minutes
+            FROM movie
+        ),
+        watched AS (
+            SELECT SUM(m.length_min) AS minutes
+            FROM diary d
+            JOIN movie m ON m.id = d.movie_id
+        )
+        SELECT
+            library.movie_count,
+            library.director_count,
+            watched.minutes,
+            library.minutes
+        FROM library, watched;
+    """)
+    movie_count, director_count, watched_minutes, library_minutes = cur.fetchone()
+
+    return {
+        "movie_count": movie_count,
+        "director_count": director_count,
+        "durations": build_durations(watched_minutes, library_minutes),
+    }
+
 # function that gets the number of each rating from 0,5 to 5,0 in the diary
 def get_diary_ratings(conn):
     cur = conn.cursor()
@@ -84,7 +122,63 @@ def get_diary_ratings(conn):
         result[rating] = rating_count
     return result
 
-from datetime import datetime
+def get_top_rating(conn):
+    """
+    Returns (rating, count) for the most common rating in the diary,
+    or (None, 0) if there is none. Ties go to the lowest rating.
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT
+            m.rating AS rating,
+            COUNT(*) AS rating_count
+        FROM diary d
+        JOIN movie m ON d.movie_id = m.id
+        WHERE m.rating IS NOT NULL
+        GROUP BY m.rating
+        ORDER BY rating_count DESC, m.rating ASC
+        LIMIT 1;
+    """)
+    row = cur.fetchone()
+    if row is None:
+        return None, 0
+    return row
+
+MONTH_NAMES = [
+    "January", "February", "March", "April", "May", "June",
+    "July", "August", "September", "October", "November", "December",
+]
+
+# Per-month diary aggregates; callers add ORDER BY / LIMIT
+MONTHLY_STATS_SQL = """
+    SELECT
+        strftime('%Y-%m', d.watched_date) AS month,   -- 'YYYY-MM'
+        COUNT(*) AS watches,
+        SUM(d.rewatch) AS rewatches,
+        SUM(m.length_min) AS total_minutes,
+        AVG(m.rating) AS avg_rating
+    FROM diary d
+    JOIN movie m ON m.id = d.movie_id
+    GROUP BY month
+"""
+
+def build_month_stats(month_str, watches, rewatches, minutes, avg_rating):
+    """
+    Turn one MONTHLY_STATS_SQL row into ('January 2024', stats).
+    """
+    minutes = minutes or 0
+    rewatches = rewatches or 0
+
+    # Convert "YYYY-MM" to "MonthName YYYY"
+    pretty_month = f"{MONTH_NAMES[int(month_str[5:7]) - 1]} {month_str[:4]}"
+
+    return pretty_month, {
+        "watches": watches,
+        "rewatches": rewatches,
+        "minutes": minutes,
+        "hours": minutes / 60.0,
+        "avg_rating": avg_rating,
+    }
 
 def get_monthly_stats(conn):
     """
@@ -97,50 +191,33 @@ def get_monthly_stats(conn):
     """
 
     cur = conn.cursor()
+    cur.execute(MONTHLY_STATS_SQL + "ORDER BY month;")
 
-    cur.execute("""
-        SELECT
-            SUBSTR(d.watched_date, 1, 7) AS month,   -- 'YYYY-MM'
-            COUNT(*) AS watches,
-            SUM(d.rewatch) AS rewatches,
-            SUM(m.length_min) AS total_minutes,
-            AVG(m.rating) AS avg_rating
-        FROM diary d
-        JOIN movie m ON m.id = d.movie_id
-        GROUP BY month
-        ORDER BY month;
-    """)
-
-    rows = cur.fetchall()
-
-    stats = {}
-
-    for month_str, watches, rewatches, minutes, avg_rating in rows:
-        minutes = minutes or 0
-        rewatches = rewatches or 0
+    return dict(build_month_stats(*row) for row in cur.fetchall())
 
-        # Convert "YYYY-MM" to "MonthName YYYY"
-        month_obj = datetime.strptime(month_str, "%Y-%m")
-        pretty_month = month_obj.strftime("%b")
-
-        stats[pretty_month] = {
-            "watches": watches,
-            "rewatches": rewatches,
-            "minutes": minutes,
-            "hours": minutes / 60.0,
-            "avg_rating": avg_rating,
-        }
-
-    return stats
+def get_best_month(conn):
+    """
+    Returns ('January 2024', stats) for the month with the most watches,
+    or (None, None) if the diary is empty. Ties go to the earliest month.
+    Stats are the same as in get_monthly_stats().
+    """
+    cur = conn.cursor()
+    cur.execute(MONTHLY_STATS_SQL + "ORDER BY watches DESC, month ASC LIMIT 1;")
+    row = cur.fetchone()
+    if row is None:
+        return None, None
+    return build_month_stats(*row)
 
 if __name__ == "__main__":
     conn = sqlite3.connect(DB_PATH)
 
+    all_stats = get_all_stats(conn)
+
     print("\nGeneral analysis of the movie database:")
-    print(f"Total movies in database: {get_movie_count(conn)}")
-    print(f"Total unique directors in database: {get_director_count(conn)}")
+    print(f"Total movies in database: {all_stats['movie_count']}")
+    print(f"Total unique directors in database: {all_stats['director_count']}")
 
-    watch_duration = get_total_durations(conn)
+    watch_duration = all_stats["durations"]
     print(f"Total library duration (in hours): {watch_duration['library']['hours']:.1f}")
     print(f"Total diary duration (in hours): {watch_duration['watched']['hours']:.1f}")
 
@@ -151,7 +228,7 @@ if __name__ == "__main__":
 
     monthly_stats = get_monthly_stats(conn)
     print("\nMonthly stats:")
-    for month in sorted(monthly_stats.keys()):
+    for month in monthly_stats:  # already in chronological order
         stats = monthly_stats[month]
         print(f"  {month}: {stats['watches']} watches, {stats['rewatches']} rewatches, "
               f"{stats['hours']:.1f} hours, avg rating {stats['avg_rating']:.2f}")
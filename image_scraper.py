@@ -1,34 +1,70 @@
-import re
-import requests
-import sqlite3
+import json
+import requests_cache
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import lru_cache
 from pathlib import Path
 from io import BytesIO
 import time
 import os
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from top5_analysis import analyze  # your analyze() from the code you pasted
+from top5_analysis import analyze_cached, connect, slugify
 
 DB_PATH = Path("data/movies.db")
 
+@lru_cache(maxsize=1)
 def get_tmdb_credentials():
-    load_dotenv("Credentials/TMDB_key_credentials.env")
+    """Read the .env once, on first TMDB call rather than at import."""
+    # Already exported (or loaded by another module) -> skip re-reading the .env
+    if "TMDB_API_KEY" not in os.environ:
+        load_dotenv("Credentials/TMDB_key_credentials.env")
     return os.getenv("TMDB_ACCESS_TOKEN"), os.getenv("TMDB_API_KEY")
 
-TMDB_ACCESS_TOKEN, TMDB_API_KEY = get_tmdb_credentials()
-
 # Put your real TMDB API key here
 TMDB_API_BASE = "https://api.themoviedb.org/3"
 TMDB_IMG_BASE = "https://image.tmdb.org/t/p"
 
+# Parallel downloads; TMDB API calls are additionally capped by TMDB_API_SLOTS
+# to stay under TMDB's rate limit (image.tmdb.org downloads aren't limited).
+MAX_WORKERS = 16
+TMDB_API_SLOTS = threading.Semaphore(8)
+
+# TMDB search/images responses are cached on disk (shared with build_database),
+# so re-running the scraper doesn't repeat API calls. Image files themselves
+# are already kept under images/, so image.tmdb.org is never cached.
+TMDB_CACHE_PATH = Path("data/tmdb_cache.sqlite")
+
+# One pooled session for all threads, retrying rate limits and server errors.
+# raise_on_status=False hands the last response back so callers can check it.
+SESSION = requests_cache.CachedSession(
+    str(TMDB_CACHE_PATH),
+    backend="sqlite",
+    expire_after=timedelta(days=30),
+    urls_expire_after={"image.tmdb.org": requests_cache.DO_NOT_CACHE},
+)
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False,
+    ),
+))
+# Identify ourselves to TMDB; gzip keeps the JSON responses small.
+SESSION.headers.update({
+    "User-Agent": "LetterboxdWrapped/1.0",
+    "Accept-Encoding": "gzip, deflate",
+})
 
-# ---------- Small helpers ----------
-
-def slugify(name: str) -> str:
-    """Simple slug: 'Christopher Nolan' -> 'Christopher_Nolan'."""
-    name = name.strip().replace(" ", "_")
-    return re.sub(r"[^A-Za-z0-9_]+", "", name)
 
+# ---------- Small helpers ----------
 
 def ensure_dir(path: Path):
     path.mkdir(parents=True, exist_ok=True)
@@ -40,14 +76,15 @@ def tmdb_search_movie(title: str, year: int | None = None) -> int | None:
     (Fallback if tmdb_id in DB is NULL)
     """
     params = {
-        "api_key": TMDB_API_KEY,
+        "api_key": get_tmdb_credentials()[1],
         "query": title,
         "include_adult": "false",
     }
     if year is not None:
         params["year"] = year
 
-    resp = requests.get(f"{TMDB_API_BASE}/search/movie", params=params)
+    with TMDB_API_SLOTS:
+        resp = SESSION.get(f"{TMDB_API_BASE}/search/movie", params=params, timeout=30)
     resp.raise_for_status()
     data = resp.json()
     results = data.get("results") or []
@@ -61,8 +98,9 @@ def tmdb_get_movie_images(tmdb_id: int) -> tuple[list[str], list[str]]:
     Return (poster_paths, backdrop_paths) for a TMDB movie ID.
     These are relative paths like '/abcd123.jpg'.
     """
-    params = {"api_key": TMDB_API_KEY}
-    resp = requests.get(f"{TMDB_API_BASE}/movie/{tmdb_id}/images", params=params)
+    params = {"api_key": get_tmdb_credentials()[1]}
+    with TMDB_API_SLOTS:
+        resp = SESSION.get(f"{TMDB_API_BASE}/movie/{tmdb_id}/images", params=params, timeout=30)
     resp.raise_for_status()
     data = resp.json()
     posters = [p["file_path"] for p in data.get("posters", []) if p.get("file_path")]
@@ -70,28 +108,51 @@ def tmdb_get_movie_images(tmdb_id: int) -> tuple[list[str], list[str]]:
     return posters, backdrops
 
 
+def has_image(path: Path) -> bool:
+    """True if path is a non-empty file (an empty one is a failed download)."""
+    try:
+        return path.stat().st_size > 0
+    except FileNotFoundError:
+        return False
+
+
 def download_image(url: str, dest_path: Path):
     """Download an image from URL to dest_path, skipping if already exists."""
-    if dest_path.exists():
+    if has_image(dest_path):
         return
-    resp = requests.get(url, stream=True)
-    if resp.status_code == 200:
-        with dest_path.open("wb") as f:
-            for chunk in resp.iter_content(8192):
-                f.write(chunk)
+    resp = SESSION.get(url, timeout=30)
+    if resp.status_code == 200 and resp.content:
+        # Posters/backdrops are only a few MB: one write instead of 8 KiB chunks.
+        # Write to a unique .part file and rename, so a crash never leaves a
+        # truncated image that looks complete on the next run, and two writers
+        # of the same destination never share a temp file.
+        fd, part_name = tempfile.mkstemp(dir=dest_path.parent, prefix=dest_path.name + ".", suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(resp.content)
+            os.chmod(part_name, 0o644)  # mkstemp creates 0600 files
+            os.replace(part_name, dest_path)
+        except BaseException:
+            Path(part_name).unlink(missing_ok=True)
+            raise
 
 
-def get_movie_tmdb_id(conn, title: str) -> tuple[int | None, int | None]:
+def get_movie_tmdb_ids(conn, titles: list[str]) -> dict[str, tuple[int | None, int | None]]:
     """
-    Look up tmdb_id and year for a movie by title from the movie table.
-    Returns (tmdb_id, year).
+    Look up tmdb_id and year for several movies by title in one query.
+    Returns {title: (tmdb_id, year)}; titles not in the movie table are missing.
     """
     cur = conn.cursor()
-    cur.execute("SELECT tmdb_id, year FROM movie WHERE title = ? LIMIT 1;", (title,))
-    row = cur.fetchone()
-    if row:
-        return row[0], row[1]
-    return None, None
+    cur.execute("""
+        SELECT title, tmdb_id, year
+        FROM movie
+        WHERE title IN (SELECT value FROM json_each(?))
+        ORDER BY id;
+    """, (json.dumps(titles),))
+    found = {}
+    for title, tmdb_id, year in cur.fetchall():
+        found.setdefault(title, (tmdb_id, year))  # first match, like LIMIT 1
+    return found
 
 
 def download_movie_images_for_target(
@@ -101,6 +162,7 @@ def download_movie_images_for_target(
     target_root: Path,
     max_posters: int = 5,
     max_backdrops: int = 5,
+    slug: str | None = None,
 ):
     """
     Download posters & backdrops for a movie into:
@@ -108,10 +170,19 @@ def download_movie_images_for_target(
         target_root/<movie_slug>/posters/*.jpg
         target_root/<movie_slug>/backdrops/*.jpg
     where target_root may be e.g. images/movie or images/director/Christopher_Nolan.
+    slug is the movie's stored slug (movie.slug); computed from title if missing.
     """
-    movie_slug = slugify(title)
+    movie_slug = slug or slugify(title)
     posters_dir = target_root / movie_slug / "posters"
     backdrops_dir = target_root / movie_slug / "backdrops"
+
+    # Already fully scraped on an earlier run -> no TMDB calls needed
+    if posters_dir.exists() and backdrops_dir.exists():
+        n_posters = sum(1 for p in posters_dir.glob("poster_*.jpg") if has_image(p))
+        n_backdrops = sum(1 for b in backdrops_dir.glob("backdrop_*.jpg") if has_image(b))
+        if n_posters >= max_posters and n_backdrops >= max_backdrops:
+            return
+
     ensure_dir(posters_dir)
     ensure_dir(backdrops_dir)
 
@@ -148,47 +219,59 @@ def download_movie_images_for_target(
 
 # ---------- DB-based helpers for director/actor movies ----------
 
-def get_director_movies(conn, director_name: str, limit=5):
+def group_top_movies(rows, names: list[str], limit: int) -> dict[str, list[tuple]]:
     """
-    Get up to 'limit' movies for a given director, ordered by rating desc.
-    Returns list of (title, tmdb_id, year).
+    Group (name, title, tmdb_id, year, slug) rows, already sorted best-first
+    per name, into {name: [(title, tmdb_id, year, slug), ...]} capped at limit.
+    """
+    grouped = {name: [] for name in names}
+    for name, *movie in rows:
+        movies = grouped[name]
+        if len(movies) < limit:
+            movies.append(tuple(movie))
+    return grouped
+
+
+def get_director_movies(conn, director_names: list[str], limit=5):
+    """
+    Get up to 'limit' movies for each director, ordered by rating desc.
+    Returns {director: [(title, tmdb_id, year, slug), ...]}.
     """
     cur = conn.cursor()
     cur.execute("""
-        SELECT m.title, m.tmdb_id, m.year
+        SELECT m.director, m.title, m.tmdb_id, m.year, m.slug
         FROM movie m
-        WHERE m.director = ?
-        ORDER BY m.rating DESC NULLS LAST, m.year DESC
-        LIMIT ?;
-    """, (director_name, limit))
-    return cur.fetchall()
+        WHERE m.director IN (SELECT value FROM json_each(?))
+        ORDER BY m.director, m.rating DESC NULLS LAST, m.year DESC;
+    """, (json.dumps(director_names),))
+    return group_top_movies(cur.fetchall(), director_names, limit)
 
 
-def get_actor_movies(conn, actor_name: str, limit=5):
+def get_actor_movies(conn, actor_names: list[str], limit=5):
     """
-    Get up to 'limit' movies for a given actor, ordered by rating desc.
-    Returns list of (title, tmdb_id, year).
+    Get up to 'limit' movies for each actor, ordered by rating desc.
+    Returns {actor: [(title, tmdb_id, year, slug), ...]}.
     """
     cur = conn.cursor()
     cur.execute("""
-        SELECT m.title, m.tmdb_id, m.year
+        SELECT p.name, m.title, m.tmdb_id, m.year, m.slug
         FROM movie m
         JOIN movie_cast mc ON mc.movie_id = m.id
         JOIN person p ON p.id = mc.person_id
-        WHERE p.name = ?
-        ORDER BY m.rating DESC NULLS LAST, m.year DESC
-        LIMIT ?;
-    """, (actor_name, limit))
-    return cur.fetchall()
+        WHERE p.name IN (SELECT value FROM json_each(?))
+        ORDER BY p.name, m.rating DESC NULLS LAST, m.year DESC;
+    """, (json.dumps(actor_names),))
+    return group_top_movies(cur.fetchall(), actor_names, limit)
 
 
 # ---------- Main scraping logic ----------
 
 def scrape_images():
-    conn = sqlite3.connect(DB_PATH)
+    # One connection for the analysis and all lookups below
+    conn = connect(DB_PATH)
 
     # 1. Use your existing analyze() to get top 5 directors/actors/movies
-    stats = analyze()
+    stats = analyze_cached(conn=conn)
 
     # Top movies (from your analyze() structure)
     top_movies = stats["movies"]["top_watched"]  # list of dicts with "title", ...
@@ -197,20 +280,22 @@ def scrape_images():
     top_directors = [d["director"] for d in stats["directors"]["most_watched"]]
     top_actors = [a["actor"] for a in stats["actors"]["most_watched"]]
 
+    # Collect (title, tmdb_id, year, slug, target_root) for every movie to scrape,
+    # then download them all in parallel.
+    work_items = []
+
+    # One query per category instead of one per title/person
+    movie_ids = get_movie_tmdb_ids(conn, [m["title"] for m in top_movies])
+    director_movies = get_director_movies(conn, top_directors, limit=5)
+    actor_movies = get_actor_movies(conn, top_actors, limit=5)
+
     # ---- Movies ----
     movie_root = Path("images/movie")
     for m in top_movies:
         title = m["title"]
-        tmdb_id, year = get_movie_tmdb_id(conn, title)
+        tmdb_id, year = movie_ids.get(title, (None, None))
         print(f"[movie] {title} (tmdb_id={tmdb_id})")
-        download_movie_images_for_target(
-            title=title,
-            tmdb_id=tmdb_id,
-            year=year,
-            target_root=movie_root,
-            max_posters=5,
-            max_backdrops=5,
-        )
+        work_items.append((title, tmdb_id, year, m["slug"], movie_root))
 
     # ---- Directors ----
     director_root = Path("images/director")
@@ -218,16 +303,8 @@ def scrape_images():
         director_slug = slugify(name)
         person_root = director_root / director_slug
         print(f"[director] {name}")
-        movies = get_director_movies(conn, name, limit=5)
-        for title, tmdb_id, year in movies:
-            download_movie_images_for_target(
-                title=title,
-                tmdb_id=tmdb_id,
-                year=year,
-                target_root=person_root,
-                max_posters=5,
-                max_backdrops=5,
-            )
+        for title, tmdb_id, year, slug in director_movies[name]:
+            work_items.append((title, tmdb_id, year, slug, person_root))
 
     # ---- Actors ----
     actor_root = Path("images/actor")
@@ -235,16 +312,33 @@ def scrape_images():
         actor_slug = slugify(name)
         person_root = actor_root / actor_slug
         print(f"[actor] {name}")
-        movies = get_actor_movies(conn, name, limit=5)
-        for title, tmdb_id, year in movies:
-            download_movie_images_for_target(
+        for title, tmdb_id, year, slug in actor_movies[name]:
+            work_items.append((title, tmdb_id, year, slug, person_root))
+
+    # Different titles can share a slug (e.g. "Alien" / "Alien³"), and the same
+    # folder must never be written by two workers at once: keep the first item.
+    unique_items = {}
+    for item in work_items:
+        title, _, _, slug, target_root = item
+        unique_items.setdefault((target_root, slug or slugify(title)), item)
+    work_items = list(unique_items.values())
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        futures = [
+            pool.submit(
+                download_movie_images_for_target,
                 title=title,
                 tmdb_id=tmdb_id,
                 year=year,
-                target_root=person_root,
+                target_root=target_root,
                 max_posters=5,
                 max_backdrops=5,
+                slug=slug,
             )
+            for title, tmdb_id, year, slug, target_root in work_items
+        ]
+        for future in futures:
+            future.result()  # re-raise anything a worker hit
 
     conn.close()
 
@@ -1,11 +1,12 @@
+import os
 import random
-import re
 import sqlite3
+from functools import lru_cache
 from pathlib import Path
 
 from PIL import Image, ImageDraw, ImageFont
 
-from top5_analysis import analyze  # your analyze() from the code you pasted
+from top5_analysis import analyze_cached
 
 DB_PATH = Path("data/movies.db")
 IMAGE_ROOT = Path("images/movie")   # where image_scraper.py stored movie images
@@ -13,10 +14,13 @@ IMAGE_ROOT = Path("images/movie")   # where image_scraper.py stored movie images
 
 # ---------- helpers ----------
 
-def slugify(name: str) -> str:
-    """Simple slug: 'The Dark Knight' -> 'The_Dark_Knight'."""
-    name = name.strip().replace(" ", "_")
-    return re.sub(r"[^A-Za-z0-9_]+", "", name)
+@lru_cache(maxsize=None)
+def _font(size):
+    """Load Arial at the given size once; fall back to PIL's default font."""
+    try:
+        return ImageFont.truetype("Arial.ttf", size)
+    except OSError:
+        return ImageFont.load_default()
 
 
 def measure_text(draw, text, font):
@@ -26,41 +30,81 @@ def measure_text(draw, text, font):
     return width, height
 
 
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+
 def pick_random_image(directory: Path) -> Path | None:
-    if not directory.exists():
-        return None
-    files = list(directory.glob("*.jpg")) + list(directory.glob("*.jpeg")) + list(directory.glob("*.png"))
-    if not files:
+    """One scandir pass, reservoir-sampling a single image (no file list)."""
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
         return None
-    return random.choice(files)
+    chosen = None
+    seen = 0
+    with entries:
+        for entry in entries:
+            if entry.name.lower().endswith(IMAGE_SUFFIXES) and entry.is_file():
+                seen += 1
+                if random.randrange(seen) == 0:
+                    chosen = entry.path
+    return Path(chosen) if chosen else None
+
+
+def load_and_fit(path: Path, max_w: int, max_h: int, resample=Image.LANCZOS) -> Image.Image:
+    """
+    Open an image scaled to fit inside max_w x max_h (aspect kept; small
+    images are scaled up). JPEGs much larger than needed are decoded directly
+    at a reduced scale (draft) before resampling.
+    """
+    im = Image.open(path)
+    pw, ph = im.size
+    scale = min(max_w / pw, max_h / ph)
+    new_size = (int(pw * scale), int(ph * scale))
 
+    # Let libjpeg skip detail we can't use, but keep >= 2x headroom so the
+    # resample filter (after reducing_gap's box reduce) does the final step
+    im.draft("RGB", (new_size[0] * 2, new_size[1] * 2))
+    return im.convert("RGB").resize(new_size, resample, reducing_gap=2.0)
 
-def paste_cover_background(base_img: Image.Image, backdrop_path: Path | None, dim_alpha: int = 140):
+
+def load_and_cover(path: Path, width: int, height: int, resample=Image.LANCZOS) -> Image.Image:
     """
-    Paste backdrop covering the entire base_img.
-    If no backdrop, keep the base_img background as-is.
-    Dim with a semi-transparent overlay to make text readable.
+    Open an image scaled to cover width x height (fill), center-cropped to it.
+    Uses the same reduced-scale JPEG decode as load_and_fit().
     """
-    width, height = base_img.size
-    if backdrop_path is not None and backdrop_path.exists():
-        bg = Image.open(backdrop_path).convert("RGB")
+    im = Image.open(path)
+    bw, bh = im.size
+    scale = max(width / bw, height / bh)
+    new_size = (int(bw * scale), int(bh * scale))
 
-        # Resize with cover behavior (fill and crop)
-        bw, bh = bg.size
-        scale = max(width / bw, height / bh)
-        new_size = (int(bw * scale), int(bh * scale))
-        bg = bg.resize(new_size, Image.LANCZOS)
+    # Let libjpeg skip detail we can't use, but keep >= 2x headroom so the
+    # resample filter (after reducing_gap's box reduce) does the final step
+    im.draft("RGB", (new_size[0] * 2, new_size[1] * 2))
+    im = im.convert("RGB").resize(new_size, resample, reducing_gap=2.0)
 
-        # Center-crop to canvas size
-        x0 = (bg.width - width) // 2
-        y0 = (bg.height - height) // 2
-        bg = bg.crop((x0, y0, x0 + width, y0 + height))
+    # Center-crop to exactly width x height
+    x0 = (im.width - width) // 2
+    y0 = (im.height - height) // 2
+    return im.crop((x0, y0, x0 + width, y0 + height))
 
-        base_img.paste(bg, (0, 0))
 
-    # Dark overlay
-    overlay = Image.new("RGBA", (width, height), (0, 0, 0, dim_alpha))
-    base_img.alpha_composite(overlay)
+def paste_cover_background(base_img: Image.Image, backdrop_path: Path | None, dim_alpha: int = 140):
+    """
+    Paste backdrop covering the entire base_img (RGB).
+    If no backdrop, keep the base_img background as-is.
+    Dim as if covered by black at dim_alpha opacity, to make text readable.
+    """
+    width, height = base_img.size
+    # Per-channel lookup table: one pass over the pixels, like a black overlay
+    keep = 1 - dim_alpha / 255.0
+    dim_lut = [round(v * keep) for v in range(256)] * 3
+
+    if backdrop_path is not None and backdrop_path.exists():
+        # Resize with cover behavior (fill and crop), dim, then paste once
+        bg = load_and_cover(backdrop_path, width, height)
+        base_img.paste(bg.point(dim_lut), (0, 0))
+    else:
+        base_img.paste(base_img.point(dim_lut))
 
 
 # ---------- main wrapped image ----------
@@ -83,31 +127,25 @@ def create_movie_wrapped_image(stats: dict, output_path: str = "movie_wrapped_mo
 
     main_title = main_movie["title"]
 
-    # Prepare canvas (RGBA so we can alpha-composite)
+    # Prepare canvas (RGB: posters/backdrops are opaque, no alpha needed)
     width, height = 1080, 1920
-    img = Image.new("RGBA", (width, height), (18, 18, 40, 255))
+    img = Image.new("RGB", (width, height), (18, 18, 40))
     draw = ImageDraw.Draw(img)
 
     # Fonts
-    try:
-        title_font = ImageFont.truetype("Arial.ttf", 80)
-        big_font = ImageFont.truetype("Arial.ttf", 60)
-        normal_font = ImageFont.truetype("Arial.ttf", 40)
-        small_font = ImageFont.truetype("Arial.ttf", 32)
-    except OSError:
-        title_font = ImageFont.load_default()
-        big_font = ImageFont.load_default()
-        normal_font = ImageFont.load_default()
-        small_font = ImageFont.load_default()
+    title_font = _font(80)
+    big_font = _font(60)
+    normal_font = _font(40)
+    small_font = _font(32)
 
     def center_text(text, y, font, fill=(255, 255, 255)):
-        w, h = measure_text(draw, text, font=font)
-        x = (width - w) // 2
+        # Only the width matters here: the advance length skips the bbox render
+        x = (width - int(font.getlength(text))) // 2
         draw.text((x, y), text, font=font, fill=fill)
 
     # ---------- pick random poster/backdrop for main movie ----------
 
-    main_slug = slugify(main_title)
+    main_slug = main_movie["slug"]
     main_posters_dir = IMAGE_ROOT / main_slug / "posters"
     main_backdrops_dir = IMAGE_ROOT / main_slug / "backdrops"
 
@@ -125,21 +163,16 @@ def create_movie_wrapped_image(stats: dict, output_path: str = "movie_wrapped_mo
     y_top_area = 180
 
     if main_poster_path and main_poster_path.exists():
-        poster = Image.open(main_poster_path).convert("RGBA")
-        pw, ph = poster.size
-
         # Scale poster to a max width/height
         max_poster_width = 450
         max_poster_height = 650
-        scale = min(max_poster_width / pw, max_poster_height / ph)
-        new_size = (int(pw * scale), int(ph * scale))
-        poster = poster.resize(new_size, Image.LANCZOS)
+        poster = load_and_fit(main_poster_path, max_poster_width, max_poster_height)
 
         # Paste centered
         pw, ph = poster.size
         px = (width - pw) // 2
         py = y_top_area
-        img.paste(poster, (px, py), poster)
+        img.paste(poster, (px, py))
 
         text_y = py + ph + 20
     else:
@@ -171,7 +204,7 @@ def create_movie_wrapped_image(stats: dict, output_path: str = "movie_wrapped_mo
 
     for idx, movie in enumerate(other_movies, start=2):
         title = movie["title"]
-        slug = slugify(title)
+        slug = movie["slug"]
         posters_dir = IMAGE_ROOT / slug / "posters"
         backdrops_dir = IMAGE_ROOT / slug / "backdrops"
 
@@ -183,11 +216,8 @@ def create_movie_wrapped_image(stats: dict, output_path: str = "movie_wrapped_mo
         poster_height = 260  # target height for row
 
         if poster_path and poster_path.exists():
-            poster = Image.open(poster_path).convert("RGBA")
-            pw, ph = poster.size
-            scale = min(poster_width / pw, poster_height / ph)
-            new_size = (int(pw * scale), int(ph * scale))
-            poster = poster.resize(new_size, Image.LANCZOS)
+            # Small thumbnail: BILINEAR is indistinguishable here and much cheaper
+            poster = load_and_fit(poster_path, poster_width, poster_height, Image.BILINEAR)
             pw, ph = poster.size
         else:
             # No poster -> fake box size
@@ -200,7 +230,7 @@ def create_movie_wrapped_image(stats: dict, output_path: str = "movie_wrapped_mo
         py = current_y
 
         if poster is not None:
-            img.paste(poster, (px, py), poster)
+            img.paste(poster, (px, py))
 
         # --- Text area on the right ---
         text_x = px + pw + 30
@@ -223,26 +253,13 @@ def create_movie_wrapped_image(stats: dict, output_path: str = "movie_wrapped_mo
         available_width = (width - 80) - text_x  # right side up to 80 px margin
 
         if backdrop_path and backdrop_path.exists() and available_height > 40:
-            backdrop = Image.open(backdrop_path).convert("RGBA")
-            bw, bh = backdrop.size
-
-            # Scale backdrop to cover the right-side area
-            scale = max(available_width / bw, available_height / bh)
-            new_bw = int(bw * scale)
-            new_bh = int(bh * scale)
-            backdrop = backdrop.resize((new_bw, new_bh), Image.LANCZOS)
-
-            # Center-crop to exactly the available area
-            x0 = (new_bw - available_width) // 2
-            y0 = (new_bh - available_height) // 2
-            backdrop = backdrop.crop(
-                (x0, y0, x0 + available_width, y0 + available_height)
-            )
+            # Scale backdrop to cover the right-side area, cropped to fit
+            backdrop = load_and_cover(backdrop_path, available_width, available_height, Image.BILINEAR)
 
             # Paste so that bottom aligns with poster bottom
             by = backdrop_top
             bx = text_x
-            img.paste(backdrop, (bx, by), backdrop)
+            img.paste(backdrop, (bx, by))
 
         # Move down for next row
         current_y += row_height + row_margin
@@ -258,12 +275,12 @@ def create_movie_wrapped_image(stats: dict, output_path: str = "movie_wrapped_mo
     )
 
     # Save
-    img = img.convert("RGB")  # strip alpha for final PNG/JPEG
-    img.save(output_path, "PNG")
+    # Share image, written once: favour encode speed over file size
+    img.save(output_path, "PNG", compress_level=1, optimize=False)
     print(f"Movie wrapped image saved to {output_path}")
 
 
 if __name__ == "__main__":
-    # Use your existing analyze() to get stats
-    stats = analyze()
+    # Use your existing analyze() to get stats (cached in the DB)
+    stats = analyze_cached()
     create_movie_wrapped_image(stats, output_path="movie_wrapped_movies.png")
@@ -1,104 +1,169 @@
+import json
+import re
 import sqlite3
 from pathlib import Path
 
 DB_PATH = Path("data/movies.db")
 
-def get_top_directors_most_watched(conn, limit=5):
+_SLUG_RE = re.compile(r"[^A-Za-z0-9_]+")
+
+
+def slugify(name: str) -> str:
+    """Simple slug: 'Christopher Nolan' -> 'Christopher_Nolan'."""
+    name = name.strip().replace(" ", "_")
+    return _SLUG_RE.sub("", name)
+
+
+def ensure_slugs(conn):
     """
-    Top directors by number of diary entries (rewatches included).
+    Make sure movie.slug (image folder name, see slugify()) exists and is
+    filled in, for databases built before the column was added.
     """
     cur = conn.cursor()
-    cur.execute("""
-        SELECT
-            m.director AS director,
-            COUNT(*) AS watch_count,
-            COUNT(DISTINCT d.movie_id) AS movie_count,
-            AVG(m.rating) AS avg_rating
-        FROM diary d
-        JOIN movie m ON d.movie_id = m.id
-        WHERE m.director IS NOT NULL
-        GROUP BY m.director
-        ORDER BY watch_count DESC
-        LIMIT ?;
-    """, (limit,))
-    rows = cur.fetchall()
+    cur.execute("PRAGMA table_info(movie);")
+    if "slug" not in {row[1] for row in cur.fetchall()}:
+        cur.execute("ALTER TABLE movie ADD COLUMN slug TEXT;")
+
+    # Backfill in one UPDATE, running slugify() inside SQLite
+    conn.create_function("slugify", 1, slugify, deterministic=True)
+    cur.execute("UPDATE movie SET slug = slugify(title) WHERE slug IS NULL;")
+    conn.commit()
+
+
+def ensure_indexes(conn):
+    """
+    Create the indexes the diary/movie/cast joins and GROUP BYs rely on.
+    Safe to call on every connection; existing indexes are left alone.
+    (movie_cast(movie_id, person_id) is already covered by its primary key.)
+    """
+    cur = conn.cursor()
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_diary_movie ON diary(movie_id);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_movie_title ON movie(title);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_movie_cast_person ON movie_cast(person_id, movie_id);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_movie_director ON movie(director) WHERE director IS NOT NULL;")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_movie_rating ON movie(rating);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_movie_slug ON movie(slug);")
+    conn.commit()
+
+
+def connect(db_path: Path = DB_PATH):
+    """
+    Open the movie database for analysis: read-friendly PRAGMAs + indexes.
+    """
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL;")
+    cur.execute("PRAGMA synchronous=NORMAL;")
+    cur.execute("PRAGMA mmap_size=268435456;")  # 256 MiB memory map
+    cur.execute("PRAGMA cache_size=-65536;")    # 64 MiB page cache
+    cur.execute("PRAGMA temp_store=MEMORY;")    # GROUP BY / DISTINCT temp b-trees
+    ensure_slugs(conn)
+    ensure_indexes(conn)
+    return conn
+
+# Per-person diary aggregates, one grouped pass each. The rated_* columns
+# only count movies with a rating and feed the "highest rated" lists, so
+# both top lists for directors (or actors) come out of a single query.
+DIRECTOR_STATS_SQL = """
+    SELECT
+        m.director AS director,
+        COUNT(*) AS watch_count,
+        COUNT(DISTINCT d.movie_id) AS movie_count,
+        AVG(m.rating) AS avg_rating,
+        COUNT(m.rating) AS rated_watch_count,
+        COUNT(DISTINCT CASE WHEN m.rating IS NOT NULL THEN d.movie_id END) AS rated_movie_count
+    FROM diary d
+    JOIN movie m ON d.movie_id = m.id
+    WHERE m.director IS NOT NULL
+    GROUP BY m.director;
+"""
+
+ACTOR_STATS_SQL = """
+    SELECT
+        p.name AS actor,
+        COUNT(*) AS watch_count,
+        COUNT(DISTINCT d.movie_id) AS movie_count,
+        AVG(m.rating) AS avg_rating,
+        COUNT(m.rating) AS rated_watch_count,
+        COUNT(DISTINCT CASE WHEN m.rating IS NOT NULL THEN d.movie_id END) AS rated_movie_count
+    FROM diary d
+    JOIN movie m      ON d.movie_id = m.id
+    JOIN movie_cast mc ON mc.movie_id = m.id
+    JOIN person p     ON p.id = mc.person_id
+    GROUP BY p.id;
+"""
+
+
+def get_person_stats(conn, sql):
+    """
+    Run DIRECTOR_STATS_SQL or ACTOR_STATS_SQL and return one dict per person,
+    keyed by the SQL column aliases (the name is under "director" or "actor").
+    """
+    cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
+    return [dict(row) for row in cur.execute(sql)]
+
+
+def rank_most_watched(person_stats, name_key, limit=5):
+    """
+    Top people by number of diary entries (rewatches included).
+    """
+    ranked = sorted(person_stats, key=lambda s: s["watch_count"], reverse=True)
 
     result = []
-    for director, watch_count, movie_count, avg_rating in rows:
+    for s in ranked[:limit]:
         result.append({
-            "director": director,
-            "watch_count": watch_count,
-            "movie_count": movie_count,
-            "avg_rating": avg_rating,
+            name_key: s[name_key],
+            "watch_count": s["watch_count"],
+            "movie_count": s["movie_count"],
+            "avg_rating": s["avg_rating"],
         })
     return result
 
 
-def get_top_directors_highest_rated(conn, limit=5):
+def rank_highest_rated(person_stats, name_key, limit=5):
     """
-    Top directors by average movie rating, but only if the user has
-    watched more than 1 different movie by them (COUNT(DISTINCT movie_id) > 1).
+    Top people by average movie rating, but only if the user has watched
+    more than 1 different rated movie by/with them. Counts only rated movies.
     """
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT
-            m.director AS director,
-            COUNT(DISTINCT d.movie_id) AS movie_count,
-            COUNT(*) AS watch_count,
-            AVG(m.rating) AS avg_rating
-        FROM diary d
-        JOIN movie m ON d.movie_id = m.id
-        WHERE m.director IS NOT NULL
-          AND m.rating IS NOT NULL
-        GROUP BY m.director
-        HAVING COUNT(DISTINCT d.movie_id) > 1
-        ORDER BY avg_rating DESC
-        LIMIT ?;
-    """, (limit,))
-    rows = cur.fetchall()
+    rated = [s for s in person_stats if s["rated_movie_count"] > 1]
+    ranked = sorted(rated, key=lambda s: s["avg_rating"], reverse=True)
 
     result = []
-    for director, movie_count, watch_count, avg_rating in rows:
+    for s in ranked[:limit]:
         result.append({
-            "director": director,
-            "movie_count": movie_count,
-            "watch_count": watch_count,
-            "avg_rating": avg_rating,
+            name_key: s[name_key],
+            "movie_count": s["rated_movie_count"],
+            "watch_count": s["rated_watch_count"],
+            "avg_rating": s["avg_rating"],
         })
     return result
 
 
+def get_top_directors_most_watched(conn, limit=5):
+    """
+    Top directors by number of diary entries (rewatches included).
+    """
+    director_stats = get_person_stats(conn, DIRECTOR_STATS_SQL)
+    return rank_most_watched(director_stats, "director", limit)
+
+
+def get_top_directors_highest_rated(conn, limit=5):
+    """
+    Top directors by average movie rating, but only if the user has
+    watched more than 1 different movie by them (COUNT(DISTINCT movie_id) > 1).
+    """
+    director_stats = get_person_stats(conn, DIRECTOR_STATS_SQL)
+    return rank_highest_rated(director_stats, "director", limit)
+
+
 def get_top_actors_most_watched(conn, limit=5):
     """
     Top actors/actresses by number of diary entries for movies they appear in.
     Rewatches count as additional watches.
     """
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT
-            p.name AS actor,
-            COUNT(*) AS watch_count,
-            COUNT(DISTINCT d.movie_id) AS movie_count,
-            AVG(m.rating) AS avg_rating
-        FROM diary d
-        JOIN movie m      ON d.movie_id = m.id
-        JOIN movie_cast mc ON mc.movie_id = m.id
-        JOIN person p     ON p.id = mc.person_id
-        GROUP BY p.id
-        ORDER BY watch_count DESC
-        LIMIT ?;
-    """, (limit,))
-    rows = cur.fetchall()
-
-    result = []
-    for actor, watch_count, movie_count, avg_rating in rows:
-        result.append({
-            "actor": actor,
-            "watch_count": watch_count,
-            "movie_count": movie_count,
-            "avg_rating": avg_rating,
-        })
-    return result
+    actor_stats = get_person_stats(conn, ACTOR_STATS_SQL)
+    return rank_most_watched(actor_stats, "actor", limit)
 
 
 def get_top_actors_highest_rated(conn, limit=5):
@@ -106,93 +171,119 @@ def get_top_actors_highest_rated(conn, limit=5):
     Top actors/actresses by average movie rating, but only if the user has
     watched more than 1 different movie with them.
     """
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT
-            p.name AS actor,
-            COUNT(DISTINCT d.movie_id) AS movie_count,
-            COUNT(*) AS watch_count,
-            AVG(m.rating) AS avg_rating
-        FROM diary d
-        JOIN movie m      ON d.movie_id = m.id
-        JOIN movie_cast mc ON mc.movie_id = m.id
-        JOIN person p     ON p.id = mc.person_id
-        WHERE m.rating IS NOT NULL
-        GROUP BY p.id
-        HAVING COUNT(DISTINCT d.movie_id) > 1
-        ORDER BY avg_rating DESC
-        LIMIT ?;
-    """, (limit,))
-    rows = cur.fetchall()
-
-    result = []
-    for actor, movie_count, watch_count, avg_rating in rows:
-        result.append({
-            "actor": actor,
-            "movie_count": movie_count,
-            "watch_count": watch_count,
-            "avg_rating": avg_rating,
-        })
-    return result
+    actor_stats = get_person_stats(conn, ACTOR_STATS_SQL)
+    return rank_highest_rated(actor_stats, "actor", limit)
 
 # Function that gets the top 5 movies by first rating and watch count
 def get_top_movies(conn, limit=5):
     cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
+    # MIN(d.rewatch) = 0 <=> the movie has at least one first watch
     cur.execute("""
         SELECT
             m.title AS title,
+            m.slug AS slug,
             COUNT(*) AS watch_count,
             AVG(m.rating) AS avg_rating
         FROM diary d
         JOIN movie m ON d.movie_id = m.id
         WHERE m.rating IS NOT NULL
-        AND EXISTS (
-                SELECT 1
-                FROM diary d2
-                WHERE d2.movie_id = d.movie_id
-                AND d2.rewatch = 0
-            )
         GROUP BY m.id
+        HAVING MIN(d.rewatch) = 0
         ORDER BY watch_count DESC, avg_rating DESC
         LIMIT ?;
     """, (limit,))
-    rows = cur.fetchall()
-
-    result = []
-    for title, watch_count, avg_rating in rows:
-        result.append({
-            "title": title,
-            "watch_count": watch_count,
-            "avg_rating": avg_rating,
-        })
-    return result
+    return [dict(row) for row in cur]
 
-def analyze(db_path: Path = DB_PATH) -> dict:
+def analyze(db_path: Path = DB_PATH, conn=None) -> dict:
     """
     Analyze the database and return a dict with:
       - top 5 most watched directors
       - top 5 highest rated directors (with >1 movie)
       - top 5 most watched actors
       - top 5 highest rated actors (with >1 movie)
+    Pass an open conn to reuse it (it is left open); otherwise db_path is opened.
     """
-    conn = sqlite3.connect(db_path)
+    own_conn = conn is None
+    if own_conn:
+        conn = connect(db_path)
 
     try:
+        # One pass each; both top lists are ranked from the same rows
+        director_stats = get_person_stats(conn, DIRECTOR_STATS_SQL)
+        actor_stats = get_person_stats(conn, ACTOR_STATS_SQL)
+
         data = {
             "directors": {
-                "most_watched": get_top_directors_most_watched(conn, limit=5),
-                "highest_rated": get_top_directors_highest_rated(conn, limit=5),
+                "most_watched": rank_most_watched(director_stats, "director", limit=5),
+                "highest_rated": rank_highest_rated(director_stats, "director", limit=5),
             },
             "actors": {
-                "most_watched": get_top_actors_most_watched(conn, limit=5),
-                "highest_rated": get_top_actors_highest_rated(conn, limit=5),
+                "most_watched": rank_most_watched(actor_stats, "actor", limit=5),
+                "highest_rated": rank_highest_rated(actor_stats, "actor", limit=5),
             },
             "movies": {
                 "top_watched": get_top_movies(conn, limit=5),
             },
         }
     finally:
-        conn.close()
+        if own_conn:
+            conn.close()
+
+    return data
+
+# Bump when the shape of analyze()'s result changes, so old cached results
+# aren't served in the new format.
+STATS_VERSION = 2
+
+# Cheap summary of the tables analyze() reads: changes whenever diary entries
+# or movies are added/removed, ratings change, or casts are replaced.
+STATS_FINGERPRINT_SQL = """
+    SELECT
+        (SELECT MAX(rowid) FROM diary),
+        (SELECT COUNT(*) FROM diary),
+        (SELECT MAX(rowid) FROM movie),
+        (SELECT TOTAL(rating) FROM movie),
+        (SELECT COUNT(*) FROM movie_cast);
+"""
+
+def analyze_cached(db_path: Path = DB_PATH, conn=None) -> dict:
+    """
+    Same as analyze(), but the result is stored in a meta table in the database
+    and only recomputed when STATS_FINGERPRINT_SQL changes.
+    conn works as in analyze().
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = connect(db_path)
+
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key   TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+
+        cur.execute(STATS_FINGERPRINT_SQL)
+        fingerprint = json.dumps([STATS_VERSION, *cur.fetchone()])
+
+        cur.execute("SELECT key, value FROM meta WHERE key IN ('stats_fingerprint', 'stats_json');")
+        meta = dict(cur.fetchall())
+        if meta.get("stats_fingerprint") == fingerprint and "stats_json" in meta:
+            return json.loads(meta["stats_json"])
+
+        data = analyze(conn=conn)
+
+        cur.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?);", [
+            ("stats_fingerprint", fingerprint),
+            ("stats_json", json.dumps(data)),
+        ])
+        conn.commit()
+    finally:
+        if own_conn:
+            conn.close()
 
     return data
 
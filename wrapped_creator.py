@@ -1,19 +1,30 @@
 from PIL import Image, ImageDraw, ImageFont
+from functools import lru_cache
 import sqlite3
 from pathlib import Path
-from io import BytesIO
-import matplotlib.pyplot as plt
 
 from general_analysis import (
-    get_movie_count,
-    get_director_count,
-    get_total_durations,
+    get_all_stats,
     get_diary_ratings,
-    get_monthly_stats,
+    get_top_rating,
+    get_best_month,
 )
 
 DB_PATH = Path("data/movies.db")
 
+# Ratings chart style — bright turquoise bars fit Wrapped
+CHART_BAR_COLOR = "#4DF6FF"
+CHART_TEXT_COLOR = (255, 255, 255)
+
+
+@lru_cache(maxsize=None)
+def _font(size):
+    """Load Arial at the given size once; fall back to PIL's default font."""
+    try:
+        return ImageFont.truetype("Arial.ttf", size)
+    except OSError:
+        return ImageFont.load_default()
+
 
 def measure_text(draw, text, font):
     bbox = draw.textbbox((0, 0), text, font=font)
@@ -22,6 +33,97 @@ def measure_text(draw, text, font):
     return width, height
 
 
+def nice_tick_step(max_value, max_ticks=5):
+    """Smallest step out of 1, 2, 5, 10, 20, 50, ... giving at most max_ticks ticks."""
+    step = 1
+    while max_value / step > max_ticks:
+        step = step * 5 // 2 if str(step)[0] == "2" else step * 2
+    return step
+
+
+def draw_ratings_chart(img, diary_ratings, x, y, width, height, title_font, label_font):
+    """
+    Draw the ratings distribution (rating -> count) as a bar chart
+    inside the box (x, y, x + width, y + height) of img.
+    """
+    draw = ImageDraw.Draw(img)
+
+    ratings = sorted(diary_ratings.keys())
+    counts = [diary_ratings[r] for r in ratings]
+    max_count = max(counts)
+
+    # Title
+    title = "Rating distribution"
+    title_w, title_h = measure_text(draw, title, title_font)
+    draw.text((x + (width - title_w) // 2, y), title, font=title_font, fill=CHART_TEXT_COLOR)
+
+    # Plot area, leaving room for the title, axis labels and ticks
+    _, label_h = measure_text(draw, "0123456789", label_font)
+    plot_left = x + 2 * label_h + 60
+    plot_right = x + width - 10
+    plot_top = y + title_h + 20
+    plot_bottom = y + height - 2 * label_h - 30
+    plot_w = plot_right - plot_left
+    plot_h = plot_bottom - plot_top
+
+    # Headroom above the highest bar
+    y_max = max_count * 1.05
+
+    # Bars, one evenly spaced slot per rating
+    slot_w = plot_w / len(ratings)
+    bar_w = slot_w * 0.7
+    for i, (rating, count) in enumerate(zip(ratings, counts)):
+        bar_x = plot_left + i * slot_w + (slot_w - bar_w) / 2
+        bar_h = count / y_max * plot_h
+        draw.rectangle(
+            [(bar_x, plot_bottom - bar_h), (bar_x + bar_w, plot_bottom)],
+            fill=CHART_BAR_COLOR,
+        )
+
+        # X tick label
+        text = str(rating)
+        text_w, _ = measure_text(draw, text, label_font)
+        draw.text(
+            (bar_x + (bar_w - text_w) / 2, plot_bottom + 8),
+            text,
+            font=label_font,
+            fill=CHART_TEXT_COLOR,
+        )
+
+    # Y ticks
+    step = nice_tick_step(max_count)
+    for value in range(0, max_count + 1, step):
+        tick_y = plot_bottom - value / y_max * plot_h
+        draw.line([(plot_left - 6, tick_y), (plot_left, tick_y)], fill=CHART_TEXT_COLOR, width=2)
+        text = str(value)
+        text_w, text_h = measure_text(draw, text, label_font)
+        draw.text(
+            (plot_left - text_w - 12, tick_y - text_h / 2),
+            text,
+            font=label_font,
+            fill=CHART_TEXT_COLOR,
+        )
+
+    # Border around the plot
+    draw.rectangle([(plot_left, plot_top), (plot_right, plot_bottom)], outline=CHART_TEXT_COLOR, width=2)
+
+    # X axis label
+    text_w, _ = measure_text(draw, "Rating", label_font)
+    draw.text(
+        (plot_left + (plot_w - text_w) // 2, plot_bottom + label_h + 20),
+        "Rating",
+        font=label_font,
+        fill=CHART_TEXT_COLOR,
+    )
+
+    # Y axis label, rotated
+    bbox = draw.textbbox((0, 0), "Entries", font=label_font)
+    label_img = Image.new("RGBA", (bbox[2] - bbox[0], bbox[3] - bbox[1]), (0, 0, 0, 0))
+    ImageDraw.Draw(label_img).text((-bbox[0], -bbox[1]), "Entries", font=label_font, fill=CHART_TEXT_COLOR)
+    label_img = label_img.rotate(90, expand=True)
+    img.paste(label_img, (x, plot_top + (plot_h - label_img.height) // 2), label_img)
+
+
 def create_wrapped_image(conn, output_path: str = "movie_wrapped.png"):
     """
     Create a Spotify Wrapped-style image summarizing your movie stats,
@@ -29,31 +131,22 @@ def create_wrapped_image(conn, output_path: str = "movie_wrapped.png"):
     """
 
     # ---- 1. Gather stats ----
-    total_movies = get_movie_count(conn)
-    total_directors = get_director_count(conn)
+    all_stats = get_all_stats(conn)
+    total_movies = all_stats["movie_count"]
+    total_directors = all_stats["director_count"]
 
-    durations = get_total_durations(conn)
+    durations = all_stats["durations"]
     library_hours = durations["library"]["hours"]
     watched_hours = durations["watched"]["hours"]
 
+    # Full distribution is only needed for the chart
     diary_ratings = get_diary_ratings(conn)
-    monthly_stats = get_monthly_stats(conn)
 
     # Best month by number of watches
-    best_month, best_month_data = None, None
-    if monthly_stats:
-        best_month, best_month_data = max(
-            monthly_stats.items(),
-            key=lambda kv: kv[1]["watches"],
-        )
+    best_month, best_month_data = get_best_month(conn)
 
     # Most common rating
-    top_rating, top_rating_count = None, 0
-    if diary_ratings:
-        top_rating, top_rating_count = max(
-            diary_ratings.items(),
-            key=lambda kv: kv[1],
-        )
+    top_rating, top_rating_count = get_top_rating(conn)
 
     # ---- 2. Create base image ----
     width, height = 1080, 1920
@@ -61,14 +154,11 @@ def create_wrapped_image(conn, output_path: str = "movie_wrapped.png"):
     draw = ImageDraw.Draw(img)
 
     # Fonts
-    try:
-        title_font = ImageFont.truetype("Arial.ttf", 80)
-        big_font = ImageFont.truetype("Arial.ttf", 60)
-        normal_font = ImageFont.truetype("Arial.ttf", 40)
-    except OSError:
-        title_font = ImageFont.load_default()
-        big_font = ImageFont.load_default()
-        normal_font = ImageFont.load_default()
+    title_font = _font(80)
+    big_font = _font(60)
+    normal_font = _font(40)
+    chart_title_font = _font(28)
+    chart_font = _font(20)
 
     # Convenience
     def center_text(text, y, font, fill=(255, 255, 255)):
@@ -131,63 +221,22 @@ def create_wrapped_image(conn, output_path: str = "movie_wrapped.png"):
         center_text("No ratings found", y, normal_font)
         y += line_spacing
 
-        # ---- 4. Ratings graph embedded ----
+    # ---- 4. Ratings graph embedded ----
     if diary_ratings:
-        # Prepare data
-        ratings = sorted(diary_ratings.keys())
-        counts = [diary_ratings[r] for r in ratings]
-
-        # Create matplotlib figure in memory
-        fig, ax = plt.subplots(figsize=(6, 3), dpi=150)
-        
-        # Bar style — bright turquoise fits Wrapped
-        ax.bar(ratings, counts, color="#4DF6FF")
-
-        # White text everywhere
-        ax.set_title("Rating distribution", color="white", fontsize=14)
-        ax.set_xlabel("Rating", color="white")
-        ax.set_ylabel("Entries", color="white")
-
-        # Ticks
-        ax.set_xticks(ratings)
-        ax.set_xticklabels([str(r) for r in ratings], color="white")
-        ax.set_yticklabels(ax.get_yticks(), color="white")
-
-        # Spines (borders around plot)
-        for spine in ax.spines.values():
-            spine.set_color("white")
-
-        # Grid disabled (cleaner Spotify feel)
-        ax.grid(False)
-
-        # Backgrounds
-        ax.set_facecolor("#111128")   # dark background for inner chart
-        fig.patch.set_facecolor("#111128")
-
-        fig.tight_layout()
-
-        buf = BytesIO()
-        fig.savefig(buf, format="PNG", transparent=True)
-        plt.close(fig)
-        buf.seek(0)
-
-        chart_img = Image.open(buf).convert("RGBA")
-
-        # Resize chart to fit nicely
-        max_chart_width = width - 200
-        max_chart_height = 400
-        scale = min(
-            max_chart_width / chart_img.width,
-            max_chart_height / chart_img.height,
-        )
-        new_size = (int(chart_img.width * scale), int(chart_img.height * scale))
-        chart_img = chart_img.resize(new_size, Image.LANCZOS)
-
-        chart_w, chart_h = chart_img.size
+        chart_w, chart_h = width - 280, 400
         chart_x = (width - chart_w) // 2
         chart_y = y + 20
 
-        img.paste(chart_img, (chart_x, chart_y), chart_img)
+        draw_ratings_chart(
+            img,
+            diary_ratings,
+            chart_x,
+            chart_y,
+            chart_w,
+            chart_h,
+            title_font=chart_title_font,
+            label_font=chart_font,
+        )
         y = chart_y + chart_h + 40
 
 
@@ -202,7 +251,8 @@ def create_wrapped_image(conn, output_path: str = "movie_wrapped.png"):
     )
 
     # ---- 6. Save image ----
-    img.save(output_path, "PNG")
+    # Share image, written once: favour encode speed over file size
+    img.save(output_path, "PNG", compress_level=1, optimize=False)
     print(f"Wrapped image saved to {output_path}")
 
 